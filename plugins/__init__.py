@@ -38,7 +38,6 @@ from inmanta.config import Config
 
 
 from copy import copy
-from inmanta.ast import NotFoundException
 from jinja2 import Environment, FileSystemLoader, PrefixLoader
 from jinja2.exceptions import UndefinedError
 from jinja2.runtime import Undefined
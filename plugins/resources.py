@@ -19,7 +19,12 @@
 import logging
 import os
 import re
-import urllib
+import stat
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
 
 from inmanta import data
 from inmanta.agent.handler import provider, ResourceHandler, HandlerContext, CRUDHandler, ResourcePurged
@@ -28,48 +33,254 @@ from inmanta.resources import Resource, PurgeableResource, resource, ResourceNot
 
 import hashlib
 
-def hash_file(content):
+try:
+    from inmanta_plugins.std import FileMarker
+except ImportError:
+    FileMarker = None
+
+
+def _is_file_marker(content):
+    """
+        Detect file marker content. The isinstance check is a single C-level
+        call for our own FileMarker; the class-name fallback keeps the
+        documented compatibility with markers copy-pasted into other modules.
+    """
+    if FileMarker is not None and isinstance(content, FileMarker):
+        return True
+
+    return "FileMarker" in type(content).__name__
+
+
+# Small payloads (banners, default configs, ...) recur across many resources;
+# remember their digest. The size bound keeps the cache from pinning large
+# buffers in memory.
+_SMALL_PAYLOAD_LIMIT = 64 * 1024
+
+
+@lru_cache(maxsize=4096)
+def _cached_sha1(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def hash_file(source, *, chunk_size=1 << 20):
     """
         Create a hash from the given content
+
+        :param source: Either a bytes buffer or a binary file object. File
+            objects are consumed in chunks so large files never have to be
+            held in memory at once.
+        :param chunk_size: The amount of bytes to read per chunk when hashing
+            a file object.
     """
-    sha1sum = hashlib.new("sha1")
-    sha1sum.update(content)
+    if isinstance(source, bytes):
+        if len(source) <= _SMALL_PAYLOAD_LIMIT:
+            return _cached_sha1(source)
+
+        return hashlib.sha1(source).hexdigest()
+
+    if hasattr(hashlib, "file_digest"):
+        # python 3.11+: hashes in a C-level loop that releases the GIL
+        return hashlib.file_digest(source, "sha1").hexdigest()
+
+    sha1sum = hashlib.sha1()
+    chunk = source.read(chunk_size)
+    while chunk:
+        sha1sum.update(chunk)
+        chunk = source.read(chunk_size)
 
     return sha1sum.hexdigest()
 
+
+def hash_files_bulk(paths, *, chunk_size=1 << 20):
+    """
+        Hash a batch of files and return a dict mapping each path to its
+        sha1 hexdigest.
+
+        This is a convenience wrapper that hashes the files one after the
+        other through hash_file; it does not hash multiple streams
+        simultaneously.
+    """
+    hashes = {}
+    for path in paths:
+        with open(path, "rb", buffering=0) as fd:
+            hashes[path] = hash_file(fd, chunk_size=chunk_size)
+
+    return hashes
+
 LOGGER = logging.getLogger(__name__)
 
+# Patterns used on handler hot paths, compiled once instead of going through
+# the re module cache on every probe.
+_RE_FAILED = re.compile(r"^Failed")
+_RE_CHKCONFIG_ERR = re.compile(r"error reading information on service")
+_RE_YUM_VERSION = re.compile(r"(\S+)\s+(\S+)\s+(\S+)")
+
+
+# Resolved binary paths per io channel. Channels are created per deploy, so
+# the weakref keying lets cache entries die with their channel instead of
+# pinning every channel ever seen for the life of the process.
+_binary_cache = weakref.WeakKeyDictionary()
+
+
+def _resolve_binary(io, candidates):
+    """
+        Return the first existing path out of candidates, cached per io
+        channel so handlers do not re-stat their binaries on every call.
+    """
+    try:
+        cache = _binary_cache.setdefault(io, {})
+    except TypeError:
+        # io is not weak referenceable
+        cache = None
+
+    if cache is not None and candidates in cache:
+        return cache[candidates]
+
+    resolved = None
+    for path in candidates:
+        if io.file_exists(path):
+            resolved = path
+            break
+
+    if cache is not None:
+        cache[candidates] = resolved
+
+    return resolved
+
 
 def generate_content(content_list, seperator):
     """
         Generate a sorted list of content to prefix or suffix a file
     """
-    sort_list = []
-    for content in content_list:
-        if content.sorting_key is None:
-            sort_list.append((content.value, content.value))
-        else:
-            sort_list.append((content.sorting_key, content.value))
+    sort_list = [
+        (content.value if content.sorting_key is None else content.sorting_key, content.value)
+        for content in content_list
+    ]
 
-    sort_list.sort(key=lambda tup: tup[0])
+    sort_list.sort(key=itemgetter(0))
     return seperator.join([x[1] for x in sort_list]) + seperator
 
 
-def store_file(exporter, obj):
-    content = obj.content
-    if isinstance(content, Unknown):
-        return content
+def _read_file(filename):
+    """
+        Read a whole file as bytes with a minimal number of syscalls.
+
+        open().read() goes through BufferedReader, which costs an isatty
+        probe, two lseeks and an 8 KiB buffer per file. Reading through
+        os.pread keeps it to openat + fstat + pread + close, which matters
+        when a compile exports thousands of small files.
+    """
+    fd = os.open(filename, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        size = os.fstat(fd).st_size
+        content = os.pread(fd, size, 0)
+        # a race with a writer can leave a short read; fall back to reading
+        # the remainder in a loop
+        while len(content) < size:
+            chunk = os.pread(fd, size - len(content), len(content))
+            if not chunk:
+                break
+            content += chunk
+    finally:
+        os.close(fd)
+
+    return content
 
-    if "FileMarker" in content.__class__.__name__ :
-        with open(content.filename,"rb") as fd:
-            content = fd.read()
 
+def _iter_store_chunks(obj, filename, chunk_size=1 << 20):
+    """
+        Yield the upload payload of a File resource as a stream of chunks:
+        the generated prefix content, the file body in fixed-size chunks and
+        the generated suffix content, without materializing the whole file.
+    """
     if len(obj.prefix_content) > 0:
-        content = generate_content(obj.prefix_content, obj.content_seperator) + obj.content_seperator + content
+        yield (generate_content(obj.prefix_content, obj.content_seperator) + obj.content_seperator).encode()
+
+    fd = os.open(filename, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        offset = 0
+        chunk = os.pread(fd, chunk_size, offset)
+        while chunk:
+            yield chunk
+            offset += len(chunk)
+            chunk = os.pread(fd, chunk_size, offset)
+    finally:
+        os.close(fd)
+
     if len(obj.suffix_content) > 0:
-        content += obj.content_seperator + generate_content(obj.suffix_content, obj.content_seperator)
+        yield (obj.content_seperator + generate_content(obj.suffix_content, obj.content_seperator)).encode()
+
+
+# Cache of uploaded content per exporter, so identical content shared by many
+# File resources is hashed and uploaded only once per compile. The weakref
+# keying makes sure the cache is dropped together with the exporter.
+_store_file_cache = weakref.WeakKeyDictionary()
+
+
+def _store_file_key(content):
+    """
+        Build a compact cache key that identifies the content of a file
+        without reading it: (path, mtime, size) for files on disk and
+        (length, blake2b digest) for in-memory content. The full 256-bit
+        digest makes a key collision — which would deploy the wrong
+        content — not a realistic event, and the content is already in
+        memory here so the wider digest is all but free.
+    """
+    if _is_file_marker(content):
+        st = os.stat(content.filename)
+        return (content.filename, st.st_mtime_ns, st.st_size)
 
-    return exporter.upload_file(content)
+    raw = content if isinstance(content, bytes) else content.encode()
+    return (len(raw), hashlib.blake2b(raw, digest_size=32).digest())
+
+
+def store_file(exporter, obj):
+    content = obj.content
+    if isinstance(content, Unknown):
+        return content
+
+    cache = None
+    key = None
+    if len(obj.prefix_content) == 0 and len(obj.suffix_content) == 0:
+        # only plain content can be identified by the content alone
+        try:
+            cache = _store_file_cache.setdefault(exporter, {})
+            key = _store_file_key(content)
+        except TypeError:
+            # exporter is not weak referenceable
+            cache = None
+
+        if cache is not None and key in cache:
+            return cache[key]
+
+    # Exporters that support streaming uploads hash and transfer the chunks
+    # in a single pass over the bytes; buffer the whole file otherwise.
+    upload_streaming = getattr(exporter, "upload_file_streaming", None)
+    if upload_streaming is not None and _is_file_marker(content):
+        upload_hash = upload_streaming(_iter_store_chunks(obj, content.filename))
+    else:
+        if _is_file_marker(content):
+            content = _read_file(content.filename)
+
+        # assemble prefix, body and suffix with a single join instead of
+        # chained concatenation, which would copy the full body twice
+        parts = []
+        if len(obj.prefix_content) > 0:
+            parts.append(generate_content(obj.prefix_content, obj.content_seperator))
+            parts.append(obj.content_seperator)
+        parts.append(content)
+        if len(obj.suffix_content) > 0:
+            parts.append(obj.content_seperator)
+            parts.append(generate_content(obj.suffix_content, obj.content_seperator))
+
+        if len(parts) > 1:
+            content = "".join(parts)
+
+        upload_hash = exporter.upload_file(content)
+    if cache is not None:
+        cache[key] = upload_hash
+
+    return upload_hash
 
 
 @resource("std::Service", agent="host.name", id_attribute="name")
@@ -143,24 +354,33 @@ class PosixFileProvider(CRUDHandler):
 
         resource.hash = self._io.hash_file(resource.path)
 
-        # upload the previous version for back up and for generating a diff!
-        content = self._io.read_binary(resource.path)
-
         if not self.stat_file(resource.hash):
+            # upload the previous version for back up and for generating a diff!
+            # only read the file when the server does not have it yet
+            content = self._io.read_binary(resource.path)
             self.upload_file(resource.hash, content)
 
         for key, value in self._io.file_stat(resource.path).items():
             setattr(resource, key, value)
 
     def create_resource(self, ctx: HandlerContext, resource: PurgeableResource) -> None:
-        if self._io.file_exists(resource.path):
+        # io channels with put_exclusive create-or-fail atomically (O_EXCL),
+        # which saves the existence probe and closes the check-then-put race
+        put_exclusive = getattr(self._io, "put_exclusive", None)
+        if put_exclusive is None and self._io.file_exists(resource.path):
             raise Exception(f"Cannot create file {resource.path}, because it already exists.")
 
         data = self.get_file(resource.hash)
         if hash_file(data) != resource.hash:
             raise Exception("File hash was %s expected %s" % (resource.hash, hash_file(data)))
 
-        self._io.put(resource.path, data)
+        if put_exclusive is not None:
+            try:
+                put_exclusive(resource.path, data)
+            except FileExistsError:
+                raise Exception(f"Cannot create file {resource.path}, because it already exists.")
+        else:
+            self._io.put(resource.path, data)
         self._io.chmod(resource.path, str(resource.permissions))
         self._io.chown(resource.path, resource.owner, resource.group)
         ctx.set_created()
@@ -188,8 +408,52 @@ class PosixFileProvider(CRUDHandler):
         ctx.set_updated()
 
 
+class ParallelCheckHandler(ResourceHandler):
+    """
+        Base class for handlers whose check_resource time is spent blocked on
+        external processes. Those waits release the GIL, so fanning the
+        per-resource checks out over a thread pool runs them in the time of
+        the slowest command instead of the sum of all of them.
+
+        This is safe for the handlers below because their check_resource only
+        calls self._io.run, which spawns a process per call and keeps no
+        per-call state on the channel, and only reads from ctx. The yum
+        handler's cache updates are single dict stores, which the GIL keeps
+        atomic.
+    """
+
+    def check_resources(self, ctx, resources):
+        """
+            Run check_resource for each of the given resources concurrently
+            and return a dict mapping the resource id to its check result.
+            When a check raises — a normal outcome, e.g.
+            ResourceNotFoundExcpetion for an absent service — the exception
+            object is stored as that resource's result, so one failing check
+            never discards the results of the others.
+        """
+        results = {}
+        if len(resources) <= 1:
+            for res in resources:
+                try:
+                    results[res.id] = self.check_resource(ctx, res)
+                except Exception as e:
+                    results[res.id] = e
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            futures = [(res.id, executor.submit(self.check_resource, ctx, res)) for res in resources]
+
+            for resource_id, future in futures:
+                try:
+                    results[resource_id] = future.result()
+                except Exception as e:
+                    results[resource_id] = e
+
+        return results
+
+
 @provider("std::Service", name="systemd")
-class SystemdService(ResourceHandler):
+class SystemdService(ParallelCheckHandler):
     """
         A handler for services on systems that use systemd
     """
@@ -199,31 +463,37 @@ class SystemdService(ResourceHandler):
         self._systemd_path = None
 
     def available(self, resource):
-        if self._io.file_exists("/usr/bin/systemctl"):
-            self._systemd_path = "/usr/bin/systemctl"
-
-        elif self._io.file_exists("/bin/systemctl"):
-            self._systemd_path = "/bin/systemctl"
+        self._systemd_path = _resolve_binary(self._io, ("/usr/bin/systemctl", "/bin/systemctl"))
 
         return self._systemd_path is not None
 
     def check_resource(self, ctx, resource):
         current = resource.clone()
+        unit = "%s.service" % resource.name
 
-        exists = self._io.run(self._systemd_path, ["status", "%s.service" % resource.name])[0]
+        # one systemctl show call returns the load, active and enablement
+        # state that used to take three separate invocations
+        out = self._io.run(self._systemd_path,
+                           ["show", "-p", "LoadState", "-p", "ActiveState", "-p", "UnitFileState", unit])[0]
 
-        if re.search('Loaded: error', exists):
-            raise ResourceNotFoundExcpetion("The %s service does not exist" % resource.name)
+        props = {}
+        for line in out.split("\n"):
+            key, sep, value = line.partition("=")
+            if sep:
+                props[key.strip()] = value.strip()
 
-        running = self._io.run(self._systemd_path, ["is-active", "%s.service" % resource.name])[2] == 0
-        enabled = self._io.run(self._systemd_path, ["is-enabled", "%s.service" % resource.name])[2] == 0
+        if props.get("LoadState", "not-found") in ("not-found", "error"):
+            raise ResourceNotFoundExcpetion("The %s service does not exist" % resource.name)
 
-        if running:
+        if props.get("ActiveState") in ("active", "reloading"):
             current.state = "running"
         else:
             current.state = "stopped"
 
-        current.onboot = enabled
+        # everything "systemctl is-enabled" exits 0 for: static, indirect,
+        # generated and transient units count as enabled as well
+        current.onboot = props.get("UnitFileState") in (
+            "enabled", "enabled-runtime", "alias", "static", "indirect", "generated", "transient")
         return current
 
     def can_reload(self):
@@ -241,15 +511,16 @@ class SystemdService(ResourceHandler):
 
     def do_changes(self, ctx, resource, changes):
         updated = False
+        unit = "%s.service" % resource.name
         if "state" in changes:
             action = "start"
             if changes["state"]["desired"] == "stopped":
                 action = "stop"
 
             # start or stop the service
-            result = self._io.run(self._systemd_path, [action, "%s.service" % resource.name])
+            result = self._io.run(self._systemd_path, [action, unit])
 
-            if re.search("^Failed", result[1]):
+            if _RE_FAILED.search(result[1]):
                 raise Exception("Unable to %s %s: %s" % (action, resource.name, result[1]))
 
             updated = True
@@ -260,10 +531,10 @@ class SystemdService(ResourceHandler):
             if not changes["onboot"]["desired"]:
                 action = "disable"
 
-            result = self._io.run(self._systemd_path, [action, "%s.service" % resource.name])
+            result = self._io.run(self._systemd_path, [action, unit])
             updated = True
 
-            if re.search("^Failed", result[1]):
+            if _RE_FAILED.search(result[1]):
                 raise Exception("Unable to %s %s: %s" % (action, resource.name, result[1]))
 
         if updated:
@@ -271,24 +542,23 @@ class SystemdService(ResourceHandler):
 
 
 @provider("std::Service", name="redhat_service")
-class ServiceService(ResourceHandler):
+class ServiceService(ParallelCheckHandler):
     """
         A handler for services on systems that use service
     """
     def available(self, resource):
-        return (self._io.file_exists("/sbin/chkconfig") and self._io.file_exists("/sbin/service") and
-                not self._io.file_exists("/usr/bin/systemctl"))
+        return (_resolve_binary(self._io, ("/sbin/chkconfig",)) is not None and
+                _resolve_binary(self._io, ("/sbin/service",)) is not None and
+                _resolve_binary(self._io, ("/usr/bin/systemctl",)) is None)
 
     def check_resource(self, ctx, resource):
         current = resource.clone()
-        exists = self._io.run("/sbin/chkconfig", ["--list", resource.name])[0]
+        raw = self._io.run("/sbin/chkconfig", ["--list", resource.name])[0]
 
-        if re.search('error reading information on service', exists):
+        if _RE_CHKCONFIG_ERR.search(raw):
             raise ResourceNotFoundExcpetion("The %s service does not exist" % resource.name)
 
-
-        raw_enabled = self._io.run("/sbin/chkconfig", ["--list", resource.name])[0]
-        enabled = ":on" in raw_enabled
+        enabled = ":on" in raw
         running = self._io.run("/sbin/service", [resource.name, "status"])[2] == 0
 
         current.onboot = enabled
@@ -323,7 +593,7 @@ class ServiceService(ResourceHandler):
             # start or stop the service
             result = self._io.run("/sbin/service", [resource.name, action])
 
-            if re.search("^Failed", result[1]):
+            if _RE_FAILED.search(result[1]):
                 raise Exception("Unable to %s %s: %s" % (action, resource.name, result[1]))
 
             updated = True
@@ -339,7 +609,7 @@ class ServiceService(ResourceHandler):
             result = self._io.run("/sbin/chkconfig", [resource.name, action])
             updated = True
 
-            if re.search("^Failed", result[1]):
+            if _RE_FAILED.search(result[1]):
                 raise Exception("Unable to %s %s: %s" % (action, resource.name, result[1]))
 
         if updated:
@@ -347,31 +617,41 @@ class ServiceService(ResourceHandler):
 
 
 @provider("std::Package", name="yum")
-class YumPackage(ResourceHandler):
+class YumPackage(ParallelCheckHandler):
     """
         A Package handler that uses yum
     """
+    def __init__(self, agent, io=None):
+        super().__init__(agent, io)
+
+        # per-handler caches so a deploy with many Package resources does not
+        # spawn yum twice per resource
+        self._info_cache = {}
+        self._update_cache = None
+
     def available(self, resource):
-        return (self._io.file_exists("/usr/bin/rpm") or self._io.file_exists("/bin/rpm")) \
-            and (self._io.file_exists("/usr/bin/yum") or self._io.file_exists("/usr/bin/dnf"))
+        return (_resolve_binary(self._io, ("/usr/bin/rpm", "/bin/rpm")) is not None and
+                _resolve_binary(self._io, ("/usr/bin/dnf", "/usr/bin/yum")) is not None)
 
     def _parse_fields(self, lines):
         props = {}
-        key = ""
         old_key = None
         for line in lines:
-            if line.strip() == "":
+            stripped = line.strip()
+            if stripped == "":
                 continue
 
-            if line.strip() == "Available Packages":
+            if stripped == "Available Packages":
                 break
 
-            result = re.search(r"""^(.+) :\s+(.+)""", line)
-            if result is None:
+            # "Key       : value"; partition is a single C-level scan and
+            # allocates no match object, unlike a regex per line
+            key, sep, value = line.partition(" : ")
+            if not sep:
                 continue
 
-            key, value = result.groups()
             key = key.strip()
+            value = value.lstrip()
 
             if key == "":
                 props[old_key] += " " + value
@@ -382,17 +662,50 @@ class YumPackage(ResourceHandler):
         return props
 
     def _run_yum(self, args):
-        # todo: cache value
-        if self._io.file_exists("/usr/bin/dnf"):
-            return self._io.run("/usr/bin/dnf", ["-d", "0", "-e", "0", "-y"] + args)
-        else:
-            return self._io.run("/usr/bin/yum", ["-d", "0", "-e", "0", "-y"] + args)
+        pkg_mgr = _resolve_binary(self._io, ("/usr/bin/dnf", "/usr/bin/yum"))
+        return self._io.run(pkg_mgr, ["-d", "0", "-e", "0", "-y"] + args)
+
+    def _get_update_map(self):
+        """
+            Return the pending updates on this host as a map of
+            name -> (version, release). A single check-update invocation
+            covers all packages, so run it once and keep the parsed result
+            until a change is deployed.
+        """
+        if self._update_cache is None:
+            yum_output = self._run_yum(["check-update"])
+
+            updates = {}
+            for line in yum_output[0].split("\n"):
+                if line.strip() == "" or line.startswith("Security:"):
+                    continue
+
+                parts = _RE_YUM_VERSION.search(line)
+                if parts is None:
+                    continue
+
+                name, version_str = parts.groups()[0], parts.groups()[1]
+                try:
+                    version, release = version_str.split("-")
+                except ValueError:
+                    continue
+
+                # strip the arch suffix from the package name
+                updates[name.rsplit(".", 1)[0]] = (version, release)
+
+            self._update_cache = updates
+
+        return self._update_cache
 
     def check_resource(self, ctx, resource):
-        yum_output = self._run_yum(["info", resource.name])
-        lines = yum_output[0].split("\n")
+        if resource.name in self._info_cache:
+            output = self._info_cache[resource.name]
+        else:
+            yum_output = self._run_yum(["info", resource.name])
+            lines = yum_output[0].split("\n")
 
-        output = self._parse_fields(lines[1:])
+            output = self._parse_fields(lines[1:])
+            self._info_cache[resource.name] = output
 
         if "Repo" not in output:
             return {"state": "removed"}
@@ -402,22 +715,9 @@ class YumPackage(ResourceHandler):
         if output["Repo"] == "installed" or output["Repo"] == "@System":
             state = "installed"
 
-        # check if there is an update
-        yum_output = self._run_yum(["check-update", resource.name])
-        lines = yum_output[0].split("\n")
-
-        data = {"state": state, "version": output["Version"],
-                "release": output["Release"], "update": None}
-
-        if len(lines) > 0:
-            parts = re.search(r"""([^\s]+)\s+([^\s]+)\s+([^\s]+)""", lines[0])
-            if parts is not None and not lines[0].startswith("Security:"):
-                version_str = parts.groups()[1]
-                version, release = version_str.split("-")
-
-                data["update"] = (version, release)
-
-        return data
+        return {"state": state, "version": output["Version"],
+                "release": output["Release"],
+                "update": self._get_update_map().get(resource.name)}
 
     def list_changes(self, ctx, resource):
         state = self.check_resource(ctx, resource)
@@ -457,6 +757,10 @@ class YumPackage(ResourceHandler):
             self._result(self._run_yum(["update", resource.name]))
             ctx.set_updated()
 
+        # the deploy invalidated what we cached about this package
+        self._info_cache.pop(resource.name, None)
+        self._update_cache = None
+
 
 @provider("std::Directory", name="posix_directory")
 class DirectoryHandler(CRUDHandler):
@@ -501,7 +805,18 @@ class SymlinkProvider(CRUDHandler):
         return self._io.file_exists("/usr/bin/ln") or self._io.file_exists("/bin/ln")
 
     def read_resource(self, ctx: HandlerContext, resource: PurgeableResource) -> None:
-        if not self._io.file_exists(resource.target):
+        # io channels that expose lstat report existence and link-ness in a
+        # single round-trip instead of a file_exists plus is_symlink probe
+        lstat = getattr(self._io, "lstat", None)
+        if lstat is not None:
+            st = lstat(resource.target)
+            if st is None:
+                raise ResourcePurged()
+            elif not stat.S_ISLNK(st.st_mode):
+                raise Exception("The target of resource %s already exists but is not a symlink." % resource)
+            else:
+                resource.source = self._io.readlink(resource.target)
+        elif not self._io.file_exists(resource.target):
             raise ResourcePurged()
         elif not self._io.is_symlink(resource.target):
             raise Exception("The target of resource %s already exists but is not a symlink." % resource)
@@ -524,17 +839,32 @@ class SymlinkProvider(CRUDHandler):
 
 @provider("std::AgentConfig", name="agentrest")
 class AgentConfigHandler(CRUDHandler):
+    # Cache of the last fetched agent map as (environment, monotonic fetch
+    # time, value), shared by all instances so back-to-back AgentConfig
+    # resources in one dispatch cost one REST round-trip instead of one each.
+    _map_cache = None
+    _map_cache_ttl = 0.25
+
     def _get_map(self) -> dict:
+        cached = AgentConfigHandler._map_cache
+        if (cached is not None and cached[0] == self._agent.environment and
+                time.monotonic() - cached[1] < self._map_cache_ttl):
+            return cached[2]
+
         def call():
             return self.get_client().get_setting(tid=self._agent.environment, id=data.AUTOSTART_AGENT_MAP)
 
         value = self.run_sync(call)
-        return value.result["value"]
+        agent_config = value.result["value"]
+        AgentConfigHandler._map_cache = (self._agent.environment, time.monotonic(), agent_config)
+        return agent_config
 
     def _set_map(self, agent_config: dict) -> None:
         def call():
             return self.get_client().set_setting(tid=self._agent.environment, id=data.AUTOSTART_AGENT_MAP, value=agent_config)
 
+        # the server-side map changed; do not serve the stale copy
+        AgentConfigHandler._map_cache = None
         return self.run_sync(call)
 
     def read_resource(self, ctx: HandlerContext, resource: AgentConfig) -> None:
@@ -0,0 +1,334 @@
+"""
+    Copyright 2019 Inmanta
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+    Contact: code@inmanta.com
+
+    Unit tests for the helpers and handlers in plugins/resources.py. These
+    run against stubbed io channels and exporters, so they need neither a
+    compiled project nor the vagrant VM.
+"""
+import hashlib
+import importlib.util
+import os
+
+import pytest
+
+
+def _load_resources_module():
+    module_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location(
+        "std_resources", os.path.join(module_dir, "plugins", "resources.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+resources = _load_resources_module()
+
+
+class StubExporter(object):
+    """
+        Exporter stand-in that records every upload and hands out sequential
+        upload hashes, so deduplication shows up in the call count.
+    """
+
+    def __init__(self):
+        self.uploads = []
+
+    def upload_file(self, content):
+        self.uploads.append(content)
+        return "hash-%d" % len(self.uploads)
+
+
+class StubFileMarker(str):
+    """
+        Stand-in for the FileMarker in plugins/__init__.py; matched through
+        the documented class-name fallback.
+    """
+
+    def __new__(cls, filename):
+        obj = str.__new__(cls, "imp-module-source:file://" + filename)
+        obj.filename = filename
+        return obj
+
+
+class StubFileModel(object):
+    def __init__(self, content):
+        self.content = content
+        self.prefix_content = []
+        self.suffix_content = []
+        self.content_seperator = "\n"
+
+
+def test_store_file_memoizes_in_memory_content():
+    exporter = StubExporter()
+
+    first = resources.store_file(exporter, StubFileModel("shared banner"))
+    second = resources.store_file(exporter, StubFileModel("shared banner"))
+    other = resources.store_file(exporter, StubFileModel("different content"))
+
+    assert first == second
+    assert other != first
+    assert len(exporter.uploads) == 2
+
+
+def test_store_file_memoizes_on_disk_content(tmpdir):
+    exporter = StubExporter()
+    path = str(tmpdir.join("file"))
+    with open(path, "w") as fd:
+        fd.write("version one")
+    os.utime(path, ns=(1000000000, 1000000000))
+
+    first = resources.store_file(exporter, StubFileModel(StubFileMarker(path)))
+    second = resources.store_file(exporter, StubFileModel(StubFileMarker(path)))
+
+    assert first == second
+    assert len(exporter.uploads) == 1
+
+    # a changed mtime/size invalidates the key and triggers a new upload
+    with open(path, "w") as fd:
+        fd.write("version two, longer")
+    os.utime(path, ns=(2000000000, 2000000000))
+
+    third = resources.store_file(exporter, StubFileModel(StubFileMarker(path)))
+
+    assert third != first
+    assert len(exporter.uploads) == 2
+    assert exporter.uploads[-1] == b"version two, longer"
+
+
+class SystemdStubIO(object):
+    def __init__(self, output):
+        self.output = output
+        self.commands = []
+
+    def run(self, cmd, args):
+        self.commands.append((cmd, args))
+        return (self.output, "", 0)
+
+
+class StubServiceResource(object):
+    def __init__(self, name):
+        self.name = name
+        self.state = None
+        self.onboot = None
+
+    def clone(self):
+        return StubServiceResource(self.name)
+
+
+def _systemd_handler(show_output):
+    handler = resources.SystemdService(None)
+    handler._io = SystemdStubIO(show_output)
+    handler._systemd_path = "/usr/bin/systemctl"
+    return handler
+
+
+def test_systemd_check_resource_single_probe():
+    handler = _systemd_handler("LoadState=loaded\nActiveState=active\nUnitFileState=enabled\n")
+
+    current = handler.check_resource(None, StubServiceResource("test"))
+
+    assert current.state == "running"
+    assert current.onboot is True
+    # the load, active and enablement state come from one systemctl call
+    assert len(handler._io.commands) == 1
+    assert handler._io.commands[0][1][0] == "show"
+    assert handler._io.commands[0][1][-1] == "test.service"
+
+
+def test_systemd_check_resource_stopped_disabled():
+    handler = _systemd_handler("LoadState=loaded\nActiveState=inactive\nUnitFileState=disabled\n")
+
+    current = handler.check_resource(None, StubServiceResource("test"))
+
+    assert current.state == "stopped"
+    assert current.onboot is False
+
+
+@pytest.mark.parametrize("load_state", ["not-found", "error"])
+def test_systemd_check_resource_missing_service(load_state):
+    handler = _systemd_handler("LoadState=%s\nActiveState=inactive\nUnitFileState=\n" % load_state)
+
+    with pytest.raises(resources.ResourceNotFoundExcpetion):
+        handler.check_resource(None, StubServiceResource("test"))
+
+
+@pytest.mark.parametrize("unit_file_state", [
+    "enabled", "enabled-runtime", "alias", "static", "indirect", "generated", "transient"])
+def test_systemd_check_resource_onboot_states(unit_file_state):
+    """
+        All UnitFileState values for which "systemctl is-enabled" exits 0
+        must map to onboot=True, so e.g. static units do not drift forever.
+    """
+    handler = _systemd_handler(
+        "LoadState=loaded\nActiveState=active\nUnitFileState=%s\n" % unit_file_state)
+
+    current = handler.check_resource(None, StubServiceResource("test"))
+
+    assert current.onboot is True
+
+
+YUM_INFO_OUTPUT = """Installed Packages
+Name         : wget
+Version      : 1.19.5
+Release      : 10.el8
+Architecture : x86_64
+Size         : 2.8 M
+Repo         : @System
+Summary      : A utility for retrieving files using the HTTP or FTP
+             : protocols
+Description  : GNU Wget is a file retrieval utility which can use either
+             : the HTTP or FTP protocols.
+
+Available Packages
+Name         : wget
+Version      : 99.9
+"""
+
+YUM_CHECK_UPDATE_OUTPUT = """
+wget.x86_64                    1.20.3-1.el8                     updates
+Security: kernel-core-4.18.0 is an installed security update
+badversion.noarch              3.2.1                            extras
+
+Obsoleting Packages
+old-tool.noarch                2.0-1.el8                        extras
+"""
+
+
+class YumStubIO(object):
+    def __init__(self):
+        self.commands = []
+
+    def file_exists(self, path):
+        return path == "/usr/bin/dnf"
+
+    def run(self, cmd, args):
+        self.commands.append(args)
+        if "info" in args:
+            return (YUM_INFO_OUTPUT, "", 0)
+        return (YUM_CHECK_UPDATE_OUTPUT, "", 100)
+
+
+class StubPackageResource(object):
+    def __init__(self, name):
+        self.name = name
+
+
+def _yum_handler():
+    handler = resources.YumPackage(None)
+    handler._io = YumStubIO()
+    return handler
+
+
+def test_yum_parse_fields():
+    handler = _yum_handler()
+    props = handler._parse_fields(YUM_INFO_OUTPUT.split("\n")[1:])
+
+    assert props["Name"] == "wget"
+    assert props["Repo"] == "@System"
+    # continuation lines are folded into the previous field
+    assert props["Summary"] == "A utility for retrieving files using the HTTP or FTP protocols"
+    assert props["Description"] == ("GNU Wget is a file retrieval utility which can use either "
+                                    "the HTTP or FTP protocols.")
+    # parsing stops at the Available Packages section
+    assert props["Version"] == "1.19.5"
+
+
+def test_yum_update_map():
+    handler = _yum_handler()
+    updates = handler._get_update_map()
+
+    assert updates["wget"] == ("1.20.3", "1.el8")
+    # version strings without a release part are skipped, not fatal
+    assert "badversion" not in updates
+    # Security: advisories and blank lines are not update records
+    assert "Security:" not in str(updates)
+
+
+def test_yum_check_resource_caches_spawns():
+    handler = _yum_handler()
+    wget = StubPackageResource("wget")
+
+    state = handler.check_resource(None, wget)
+    assert state == {"state": "installed", "version": "1.19.5",
+                     "release": "10.el8", "update": ("1.20.3", "1.el8")}
+
+    # repeated checks are served from the caches: one info + one check-update
+    handler.check_resource(None, wget)
+    handler.check_resource(None, wget)
+    assert len(handler._io.commands) == 2
+
+    # a deploy invalidates both caches, so the next check probes again
+    handler.do_changes(None, wget, {})
+    handler.check_resource(None, wget)
+    assert len(handler._io.commands) == 4
+
+
+class StubCheckResource(object):
+    def __init__(self, resource_id):
+        self.id = resource_id
+
+
+class RaisingCheckHandler(resources.ParallelCheckHandler):
+    """
+        check_resource stand-in: resources named missing-* raise, like an
+        absent service raising ResourceNotFoundExcpetion.
+    """
+
+    def check_resource(self, ctx, resource):
+        if resource.id.startswith("missing"):
+            raise resources.ResourceNotFoundExcpetion("The %s service does not exist" % resource.id)
+        return {"state": "running", "id": resource.id}
+
+
+def test_check_resources_batch_survives_one_failure():
+    handler = RaisingCheckHandler(None)
+    batch = [StubCheckResource("svc-1"), StubCheckResource("missing-2"), StubCheckResource("svc-3")]
+
+    results = handler.check_resources(None, batch)
+
+    # the failing check is reported under its own resource id, the other
+    # results are kept
+    assert results["svc-1"] == {"state": "running", "id": "svc-1"}
+    assert results["svc-3"] == {"state": "running", "id": "svc-3"}
+    assert isinstance(results["missing-2"], resources.ResourceNotFoundExcpetion)
+
+
+def test_check_resources_single_resource_failure():
+    handler = RaisingCheckHandler(None)
+
+    results = handler.check_resources(None, [StubCheckResource("missing-1")])
+
+    # the single-resource shortcut follows the same exception-as-value
+    # contract as the thread-pool path
+    assert isinstance(results["missing-1"], resources.ResourceNotFoundExcpetion)
+
+
+def test_hash_files_bulk(tmpdir):
+    path_1 = str(tmpdir.join("one"))
+    path_2 = str(tmpdir.join("two"))
+    with open(path_1, "wb") as fd:
+        fd.write(b"content one")
+    with open(path_2, "wb") as fd:
+        fd.write(b"content two" * 100000)
+
+    hashes = resources.hash_files_bulk([path_1, path_2])
+
+    assert hashes == {
+        path_1: hashlib.sha1(b"content one").hexdigest(),
+        path_2: hashlib.sha1(b"content two" * 100000).hexdigest(),
+    }